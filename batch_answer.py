@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from typing import Dict, Iterator, List, Set, Tuple
+
+from dotenv import load_dotenv
+
+from llm_api import LLMService
+
+
+def read_questions(input_path: str, id_field: str = "id", question_field: str = "question") -> Iterator[Tuple[str, str]]:
+    """Stream questions from jsonl file
+    Args:
+        input_path (str): path to jsonl file, one json object per line
+        id_field (str): key with question id (line number is used if missing)
+        question_field (str): key with question text
+    Returns:
+        Iterator[Tuple[str, str]]: pairs (question id, question text)
+    """
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"Строка {line_number}: некорректный json, пропускаем")
+                continue
+            if not isinstance(item, dict):
+                logging.warning(f"Строка {line_number}: ожидается json объект, пропускаем")
+                continue
+            question = item.get(question_field)
+            if not question:
+                logging.warning(f"Строка {line_number}: нет поля '{question_field}', пропускаем")
+                continue
+            yield str(item.get(id_field, line_number)), question
+
+
+def load_completed_ids(output_path: str) -> Set[str]:
+    """Collect ids of already answered questions from previous runs
+    Args:
+        output_path (str): path to output jsonl file
+    Returns:
+        Set[str]: ids with status "ok" (failed items are retried)
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Последняя строка могла оборваться при падении процесса
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["id"])
+    return completed
+
+
+def _ends_with_newline(path: str) -> bool:
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def batched(items: Iterator[Tuple[str, str]], batch_size: int) -> Iterator[List[Tuple[str, str]]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def answer_question(
+        llm_service: LLMService,
+        semaphore: asyncio.Semaphore,
+        output_file,
+        question_id: str,
+        question: str,
+        prompt: str,
+        retrieval_s: float
+) -> bool:
+    async with semaphore:
+        started = time.perf_counter()
+        record: Dict = {"id": question_id, "question": question}
+        try:
+            record["answer"] = await llm_service.agenerate_from_prompt(prompt)
+            record["status"] = "ok"
+        except Exception as e:
+            logging.error(f"Ошибка генерации ответа для {question_id}: {e}")
+            record["error"] = str(e)
+            record["status"] = "error"
+        llm_s = time.perf_counter() - started
+    record["timings"] = {
+        "retrieval_s": round(retrieval_s, 4),
+        "llm_s": round(llm_s, 4),
+        "total_s": round(retrieval_s + llm_s, 4)
+    }
+    output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    output_file.flush()
+    return record["status"] == "ok"
+
+
+async def run_batch(
+        llm_service: LLMService,
+        input_path: str,
+        output_path: str,
+        batch_size: int = 64,
+        concurrency: int = 8,
+        id_field: str = "id",
+        question_field: str = "question"
+):
+    """Answer all questions from input jsonl and append results to output jsonl
+    Retrieval runs in vectorized batches of `batch_size` questions in a worker
+    thread, while LLM calls of previous batches keep running with at most
+    `concurrency` requests in flight. Every answer is written as soon as it is
+    ready, so a restarted run skips questions that were already answered.
+    Args:
+        llm_service (LLMService): service with retrievers and llm
+        input_path (str): jsonl file with questions
+        output_path (str): jsonl file with answers (appended)
+        batch_size (int): number of questions per retrieval batch
+        concurrency (int): max number of simultaneous llm requests
+        id_field (str): key with question id
+        question_field (str): key with question text
+    """
+    completed = load_completed_ids(output_path)
+    if completed:
+        logging.info(f"Найдено {len(completed)} готовых ответов, они будут пропущены")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = set()
+    stats = {"ok": 0, "error": 0}
+    started = time.perf_counter()
+
+    def collect(done):
+        for task in done:
+            stats["ok" if task.result() else "error"] += 1
+
+    questions = (
+        (question_id, question)
+        for question_id, question in read_questions(input_path, id_field, question_field)
+        if question_id not in completed
+    )
+
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        if output_file.tell() > 0 and not _ends_with_newline(output_path):
+            # Дописываем перенос, чтобы не склеиться с оборванной строкой
+            output_file.write("\n")
+        for batch in batched(questions, batch_size):
+            batch_started = time.perf_counter()
+            queries = [question for _, question in batch]
+            recommendations = await asyncio.to_thread(llm_service.retrieve_batch, queries)
+            # Время батча делим поровну между вопросами
+            retrieval_s = (time.perf_counter() - batch_started) / len(batch)
+
+            for (question_id, question), question_recommendations in zip(batch, recommendations):
+                prompt = llm_service.build_prompt(question, question_recommendations)
+                pending.add(asyncio.create_task(answer_question(
+                    llm_service, semaphore, output_file, question_id, question, prompt, retrieval_s
+                )))
+
+            # Не даем очереди промптов расти быстрее, чем отвечает LLM
+            while len(pending) > batch_size + concurrency:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                collect(done)
+
+            logging.info(
+                f"Обработано: {stats['ok']} ok, {stats['error']} ошибок, "
+                f"{time.perf_counter() - started:.1f} c"
+            )
+
+        if pending:
+            done, _ = await asyncio.wait(pending)
+            collect(done)
+
+    logging.info(
+        f"Готово: {stats['ok']} ok, {stats['error']} ошибок, "
+        f"{time.perf_counter() - started:.1f} c"
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Пакетная генерация ответов на вопросы абитуриентов")
+    parser.add_argument("input", help="jsonl файл с вопросами")
+    parser.add_argument("output", help="jsonl файл для ответов (дописывается, используется для продолжения)")
+    parser.add_argument("--model", default="gpt-4.1-mini")
+    parser.add_argument("--data-dir", default=".", help="директория с curriculum_courses_*.csv")
+    parser.add_argument("--max-programs", type=int, default=2, help="программ в контексте одного вопроса")
+    parser.add_argument("--batch-size", type=int, default=64, help="вопросов в одном батче поиска")
+    parser.add_argument("--concurrency", type=int, default=8, help="одновременных запросов к LLM")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--question-field", default="question")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    args = parse_args()
+
+    llm_service = LLMService(model=args.model, data_dir=args.data_dir, max_programs=args.max_programs)
+    asyncio.run(run_batch(
+        llm_service,
+        input_path=args.input,
+        output_path=args.output,
+        batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        id_field=args.id_field,
+        question_field=args.question_field
+    ))
@@ -1,4 +1,6 @@
 import os
+import math
+import signal
 import logging
 import asyncio
 from dotenv import load_dotenv
@@ -9,10 +11,14 @@ import torch
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ChatAction
-from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+from aiogram.types import FSInputFile, Message
+from langchain_huggingface import HuggingFaceEmbeddings
 
 from llm_api import LLMService
+from program_registry import ProgramRegistry
+from profiling import ProfilingSession
+from vector_store import CourseRetriever
 
 load_dotenv()
 TOKEN = os.getenv("SUPER_BOT_KEY")
@@ -22,6 +28,18 @@ dp = Dispatcher()
 
 llm_service = LLMService(model="gpt-4.1-mini")
 
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+PROFILE_DEFAULT_DURATION = 60
+PROFILE_MAX_DURATION = 600
+PROFILE_TARGETS = [
+    (LLMService, "generate"),
+    (ProgramRegistry, "get_retriever"),
+    (CourseRetriever, "batch_invoke"),
+    (HuggingFaceEmbeddings, "embed_documents"),
+    (HuggingFaceEmbeddings, "embed_query"),
+]
+profiling_session = None
+
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
@@ -29,6 +47,67 @@ async def cmd_start(message: Message):
         "Привет, я бот, у которого можно спросить про магистратуру ИТМО!!!"
     )
 
+def start_profiling(duration: float = None) -> bool:
+    global profiling_session
+    if profiling_session is not None and profiling_session.running:
+        return False
+    profiling_session = ProfilingSession(PROFILE_TARGETS)
+    profiling_session.start(duration)
+    return True
+
+
+def toggle_profiling():
+    # Обработчик SIGUSR1: первый сигнал запускает профилирование, второй останавливает
+    if not start_profiling(PROFILE_DEFAULT_DURATION):
+        # Сохранение результатов не должно блокировать polling
+        future = asyncio.get_running_loop().run_in_executor(None, profiling_session.stop)
+        future.add_done_callback(lambda f: logging.info(f.result()))
+
+
+async def send_profiling_results(message: Message, session: ProfilingSession, summary: str):
+    await message.answer(summary)
+    for file_name in ("stacks.collapsed", "allocations.txt", "profile.txt", "profile.prof"):
+        file_path = os.path.join(session.output_dir, file_name)
+        # Телеграм не принимает пустые файлы, а они бывают, если методы не вызывались
+        if os.path.getsize(file_path) == 0:
+            continue
+        await message.answer_document(FSInputFile(file_path))
+
+
+@dp.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    if command.args == "stop":
+        session = profiling_session
+        summary = await asyncio.to_thread(session.stop) if session else None
+        if summary is None:
+            await message.answer("Профилирование не запущено.")
+            return
+        await send_profiling_results(message, session, summary)
+        return
+    try:
+        duration = float(command.args or PROFILE_DEFAULT_DURATION)
+    except ValueError:
+        duration = math.nan
+    if not math.isfinite(duration):
+        await message.answer("Использование: /profile [секунды] или /profile stop")
+        return
+    duration = min(max(duration, 1), PROFILE_MAX_DURATION)
+    if not start_profiling():
+        await message.answer("Профилирование уже запущено, остановить: /profile stop")
+        return
+    await message.answer(f"Профилирование запущено на {duration:.0f} c.")
+
+    session = profiling_session
+    await asyncio.sleep(duration)
+    summary = await asyncio.to_thread(session.stop)
+    if summary is None:
+        # Уже остановили командой /profile stop, файлы отправлены там
+        return
+    await send_profiling_results(message, session, summary)
+
+
 @dp.message(F.text)
 async def handle_text(message: Message):
     await message.bot.send_chat_action(message.chat.id, ChatAction.TYPING)
@@ -49,6 +128,8 @@ async def handle_other(message: Message):
 
 async def main():
     logging.basicConfig(level=logging.INFO)
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, toggle_profiling)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
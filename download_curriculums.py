@@ -7,6 +7,7 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 import time
 import os
+import json
 
 def download_pdf_from_button(url, download_dir, button_text="Скачать учебный план"):
     # Создаем директорию для загрузок, если она не существует
@@ -37,6 +38,15 @@ def download_pdf_from_button(url, download_dir, button_text="Скачать уч
         
         # Ждем загрузки страницы
         time.sleep(3)
+
+        # Сохраняем название программы, parse_pdf перенесет его в curriculum_meta_<директория>.json
+        try:
+            title = driver.find_element(By.TAG_NAME, "h1").text.strip()
+        except:
+            title = driver.title.strip()
+        with open(os.path.join(abs_download_dir, "program.json"), "w", encoding="utf-8") as f:
+            json.dump({"title": title, "url": url}, f, ensure_ascii=False, indent=4)
+        print(f"Название программы: {title}")
         
         # Ищем кнопку по тексту
         buttons = WebDriverWait(driver, 10).until(
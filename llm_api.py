@@ -1,7 +1,7 @@
 import os
 import json
 import re
-from typing import List
+from typing import Dict, List, Tuple
 import torch
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import trim_messages, HumanMessage, AIMessage, SystemMessage
@@ -10,15 +10,16 @@ from langchain_core.documents import Document
 from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers.string import StrOutputParser
 
-from vector_store import init_ensemble_retriever
+from program_registry import ProgramRegistry
 
 class LLMService:
     def __init__(
             self, 
             model: str = "gpt-4.1-mini", 
-            ai_rag_file_path: str = "./curriculum_courses_pdf_curriculum_ai.csv",
-            product_ai_rag_file_path: str = './curriculum_courses_pdf_curriculum_ai_product.csv',
-            system_prompt_template_path: str = "./system_prompt.txt"
+            data_dir: str = ".",
+            system_prompt_template_path: str = "./system_prompt.txt",
+            max_programs: int = 2,
+            memory_limit_mb: float = 1024
     ):
         self.model = ChatOpenAI(
             base_url=os.getenv("BASE_URL"),
@@ -26,17 +27,13 @@ class LLMService:
             api_key=os.getenv("LLM_KEY")
         )
 
-        self.retriever_ai = init_ensemble_retriever(
-            file_path=ai_rag_file_path,
+        self.registry = ProgramRegistry(
+            data_dir=data_dir,
             device="cuda:0" if torch.cuda.is_available() else "cpu",
-            k=5
-        )
-
-        self.retriever_ai_product = init_ensemble_retriever(
-            file_path=product_ai_rag_file_path,
-            device="cuda:0" if torch.cuda.is_available() else "cpu",
-            k=5
+            k=5,
+            memory_limit_mb=memory_limit_mb
         )
+        self.max_programs = max_programs
 
         with open(system_prompt_template_path, encoding="utf-8") as f:
             template = f.read()
@@ -45,10 +42,40 @@ class LLMService:
 
         self.llm_chain = self.model | StrOutputParser()
 
+    def build_prompt(self, user_query: str, recommendations: List[Tuple[str, List[Document]]]) -> str:
+        programs_context = "\n".join(
+            f'Учебный план "{self.registry.programs[name].title}":\n{docs}'
+            for name, docs in recommendations
+        )
+        return self.prompt_template.format(programs_context=programs_context, user_query=user_query)
+
+    def retrieve_batch(self, user_queries: List[str]) -> List[List[Tuple[str, List[Document]]]]:
+        query_vectors = self.registry.embed_queries(user_queries)
+        routes = self.registry.route(query_vectors, self.max_programs)
+
+        # Группируем запросы по программам, чтобы искать в каждом индексе одним батчем
+        queries_by_program: Dict[str, List[int]] = {}
+        for i, names in enumerate(routes):
+            for name in names:
+                queries_by_program.setdefault(name, []).append(i)
+
+        found: Dict[Tuple[str, int], List[Document]] = {}
+        for name, query_ids in queries_by_program.items():
+            retriever = self.registry.get_retriever(name)
+            docs = retriever.batch_invoke(
+                [user_queries[i] for i in query_ids],
+                query_vectors=query_vectors[query_ids]
+            )
+            found.update(zip(((name, i) for i in query_ids), docs))
+
+        return [[(name, found[(name, i)]) for name in names] for i, names in enumerate(routes)]
+
+    async def agenerate_from_prompt(self, prompt: str) -> str:
+        return await self.llm_chain.ainvoke(prompt)
+
     def generate(self, user_query: str) -> str:
-        recommendations_ai = self.retriever_ai.invoke(user_query)
-        recommendations_ai_product = self.retriever_ai_product.invoke(user_query)
-        prompt = self.prompt_template.format(ai_examples=recommendations_ai, product_au_examples=recommendations_ai_product, user_query=user_query)
+        recommendations = self.retrieve_batch([user_query])[0]
+        prompt = self.build_prompt(user_query, recommendations)
         print(prompt)
         llm_output = self.llm_chain.invoke(prompt)
         return llm_output
\ No newline at end of file
@@ -324,6 +324,17 @@ def process_curriculum_directory(directory: str):
     with open(f"curriculum_for_llm_{dir_name}.md", "w", encoding="utf-8") as f:
         f.write(llm_format)
     
+    # Сохраняем метаданные программы (название пишет download_curriculums.py)
+    program_meta_path = os.path.join(directory, "program.json")
+    program_meta = {"title": dir_name}
+    if os.path.exists(program_meta_path):
+        with open(program_meta_path, encoding="utf-8") as f:
+            program_meta.update(json.load(f))
+    else:
+        print(f"Нет файла {program_meta_path}, название программы будет {dir_name}")
+    with open(f"curriculum_meta_{dir_name}.json", "w", encoding="utf-8") as f:
+        json.dump(program_meta, f, ensure_ascii=False, indent=4)
+
     # Сохраняем в CSV и возвращаем DataFrame
     df = parser.save_to_csv()
     
@@ -0,0 +1,247 @@
+import os
+import io
+import sys
+import time
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+# (класс, имя метода) - что профилируем
+ProfileTarget = Tuple[type, str]
+
+
+def _call_profiled(func, args, kwargs):
+    return func(*args, **kwargs)
+
+
+# Строка, с которой вызывается профилируемый метод: аллокации, в стеке которых она есть,
+# сделаны внутри профилируемых методов
+_CALL_LINENO = _call_profiled.__code__.co_firstlineno + 1
+
+
+class ProfilingSession:
+    def __init__(
+            self,
+            targets: List[ProfileTarget],
+            output_dir: str = "./profiles",
+            sample_interval: float = 0.005,
+            top_allocations: int = 30
+    ):
+        """
+        Time-boxed profiling of selected methods
+
+        Methods are wrapped only while the session is running and restored on stop,
+        so nothing is measured (and nothing costs) when profiling is off.
+
+        Args:
+            targets: Methods to profile, as (class, method name) pairs
+            output_dir: Directory for session results
+            sample_interval: Seconds between stack samples
+            top_allocations: The number of allocation sites in the report
+        """
+        self.targets = targets
+        self.output_dir = os.path.join(output_dir, datetime.now().strftime("%Y%m%d_%H%M%S"))
+        self.sample_interval = sample_interval
+        self.top_allocations = top_allocations
+
+        self._originals: Dict[ProfileTarget, object] = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiler = cProfile.Profile()
+        self._profiler_owner: Optional[int] = None
+        # thread id -> имя метода, внутри которого сейчас поток
+        self._scoped_threads: Dict[int, str] = {}
+        self._stacks: Counter = Counter()
+        self._calls: Counter = Counter()
+        self._wall_time: Counter = Counter()
+        # Аллокации из профилируемых методов, еще живые на момент остановки
+        self._allocations: List[tracemalloc.Statistic] = []
+        # Пик памяти внутри метода сверх памяти на входе, по имени метода
+        self._peak_memory: Counter = Counter()
+        self._stop_event = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._timer: Optional[threading.Timer] = None
+        self._started_tracemalloc = False
+        self.started_at: Optional[float] = None
+        self.running = False
+
+    def start(self, duration: Optional[float] = None):
+        """Start profiling
+        Args:
+            duration (Optional[float]): stop automatically after this many seconds
+        """
+        if not tracemalloc.is_tracing():
+            # Глубокий стек, чтобы до кадра _call_profiled доходили и аллокации внутри torch/langchain
+            tracemalloc.start(64)
+            self._started_tracemalloc = True
+
+        # Выставляем до установки оберток, иначе первые вызовы не попадут в статистику
+        self.started_at = time.perf_counter()
+        self.running = True
+        for cls, method_name in self.targets:
+            original = cls.__dict__[method_name]
+            self._originals[(cls, method_name)] = original
+            setattr(cls, method_name, self._wrap(f"{cls.__name__}.{method_name}", original))
+
+        self._sampler = threading.Thread(target=self._sample, name="profiling-sampler", daemon=True)
+        self._sampler.start()
+        if duration is not None:
+            self._timer = threading.Timer(duration, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+
+        logging.info(f"Профилирование запущено, результаты будут в {self.output_dir}")
+
+    def stop(self) -> Optional[str]:
+        """Stop profiling and dump results
+        Returns:
+            Optional[str]: short text summary (None if session is already stopped)
+        """
+        with self._lock:
+            if not self.running:
+                return None
+            self.running = False
+
+        for (cls, method_name), original in self._originals.items():
+            setattr(cls, method_name, original)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._stop_event.set()
+        self._sampler.join()
+
+        # Один снимок на всю сессию, оставляем только то, что выделено внутри профилируемых методов
+        self._allocations = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(True, __file__, _CALL_LINENO, all_frames=True),
+        ]).statistics("lineno")[:self.top_allocations]
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        summary = self._dump()
+        logging.info(f"Профилирование остановлено, результаты в {self.output_dir}")
+        return summary
+
+    def _wrap(self, name: str, func):
+        session = self
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            session._enter(name)
+            started = time.perf_counter()
+            try:
+                return _call_profiled(func, args, kwargs)
+            finally:
+                session._exit(name, time.perf_counter() - started)
+
+        return wrapper
+
+    def _enter(self, name: str):
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth = depth + 1
+        if depth > 0:
+            return
+        thread_id = threading.get_ident()
+        self._scoped_threads[thread_id] = name
+        # Пик сбрасывается глобально, при параллельных вызовах в разных потоках он приблизительный
+        self._local.memory_on_enter = None
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            self._local.memory_on_enter = tracemalloc.get_traced_memory()[0]
+        with self._lock:
+            # cProfile ведем только в одном потоке, остальные видны в семплах стеков
+            if self._profiler_owner is None:
+                try:
+                    self._profiler.enable()
+                    self._profiler_owner = thread_id
+                except ValueError:
+                    pass
+
+    def _exit(self, name: str, elapsed: float):
+        self._local.depth -= 1
+        outermost = self._local.depth == 0
+        thread_id = threading.get_ident()
+        if outermost:
+            self._scoped_threads.pop(thread_id, None)
+
+        peak = None
+        if outermost and self._local.memory_on_enter is not None and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1] - self._local.memory_on_enter
+
+        with self._lock:
+            if outermost and self._profiler_owner == thread_id:
+                self._profiler.disable()
+                self._profiler_owner = None
+            if not self.running:
+                # Вызов закончился после stop(), результаты уже сохраняются
+                return
+            self._calls[name] += 1
+            self._wall_time[name] += elapsed
+            if peak is not None:
+                self._peak_memory[name] = max(self._peak_memory[name], peak)
+
+    def _sample(self):
+        while not self._stop_event.wait(self.sample_interval):
+            frames = sys._current_frames()
+            for thread_id, name in list(self._scoped_threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    # Кадры профилировщика (обертка) в flamegraph не нужны
+                    if code.co_filename == __file__:
+                        frame = frame.f_back
+                        continue
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                stack.append(name)
+                self._stacks[";".join(reversed(stack))] += 1
+            # Не держим кадры (и их локальные переменные) до следующего семпла,
+            # иначе освобожденная память попадает в отчет об аллокациях
+            frames = frame = None
+
+    def _dump(self) -> str:
+        # Формат collapsed stacks, можно сразу отдать flamegraph.pl или speedscope
+        with open(os.path.join(self.output_dir, "stacks.collapsed"), "w", encoding="utf-8") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        self._profiler.dump_stats(os.path.join(self.output_dir, "profile.prof"))
+        stats_text = io.StringIO()
+        if self._profiler.getstats():
+            pstats.Stats(self._profiler, stream=stats_text).sort_stats("cumulative").print_stats(50)
+        with open(os.path.join(self.output_dir, "profile.txt"), "w", encoding="utf-8") as f:
+            f.write(stats_text.getvalue())
+
+        allocations = [
+            f"{stat.traceback}: +{stat.size / 1024:.1f} KiB, +{stat.count} блоков"
+            for stat in self._allocations
+        ]
+        with open(os.path.join(self.output_dir, "allocations.txt"), "w", encoding="utf-8") as f:
+            f.write("# Память, выделенная внутри профилируемых методов и еще занятая на момент остановки\n")
+            for allocation in allocations:
+                f.write(f"{allocation}\n")
+            f.write("# Пик памяти внутри метода сверх памяти на входе\n")
+            for name, peak in self._peak_memory.most_common():
+                f.write(f"{name}: {peak / 1024:.1f} KiB\n")
+
+        lines = [f"Длительность: {time.perf_counter() - self.started_at:.1f} c", "Время по методам:"]
+        for name, total in self._wall_time.most_common():
+            calls = self._calls[name]
+            lines.append(f"- {name}: {calls} вызовов, {total:.3f} c всего, {total / calls * 1000:.1f} мс в среднем")
+        lines.append("Пик памяти по методам:")
+        lines.extend(f"- {name}: {peak / 1024:.1f} KiB" for name, peak in self._peak_memory.most_common())
+        lines.append("Топ аллокаций:")
+        lines.extend(f"- {stat}" for stat in allocations[:5])
+        lines.append(f"Файлы: {self.output_dir}")
+        summary = "\n".join(lines)
+        with open(os.path.join(self.output_dir, "summary.txt"), "w", encoding="utf-8") as f:
+            f.write(summary)
+        return summary
@@ -0,0 +1,198 @@
+import os
+import csv
+import glob
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from vector_store import EMBEDDING_BATCH_SIZE, CourseRetriever, init_embeddings, init_ensemble_retriever
+
+# Файлы, которые сохраняет parse_pdf.process_curriculum_directory
+COURSES_FILE_PREFIX = "curriculum_courses_"
+META_FILE_PREFIX = "curriculum_meta_"
+# Кэш вектора программы для роутера, лежит рядом с csv
+ROUTER_FILE_PREFIX = "curriculum_router_"
+
+@dataclass
+class ProgramInfo:
+    name: str
+    title: str
+    courses_path: str
+    router_path: str
+
+
+def _read_program_title(data_dir: str, name: str) -> str:
+    meta_path = os.path.join(data_dir, f"{META_FILE_PREFIX}{name}.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            title = json.load(f).get("title")
+        if title:
+            return title
+    logging.warning(f"Нет названия программы {name} в {meta_path}, используем имя директории")
+    return name
+
+
+def load_program_vector(program: ProgramInfo, embeddings: Embeddings) -> np.ndarray:
+    """Get program vector for router, computing and caching it if needed
+    The vector is the normalized mean of course name embeddings, so every course
+    counts (a single long profile string would be cut by the model's token limit).
+    Args:
+        program (ProgramInfo): program to embed
+        embeddings (Embeddings): embedding model with normalized outputs
+    Returns:
+        np.ndarray: normalized program vector
+    """
+    if (
+        os.path.exists(program.router_path)
+        and os.path.getmtime(program.router_path) >= os.path.getmtime(program.courses_path)
+    ):
+        return np.load(program.router_path)
+
+    with open(program.courses_path, encoding="utf-8") as f:
+        course_names = list(dict.fromkeys(row["Course Name"].strip() for row in csv.DictReader(f)))
+    vector_sum = None
+    for start in range(0, len(course_names), EMBEDDING_BATCH_SIZE):
+        vectors = np.asarray(
+            embeddings.embed_documents(course_names[start:start + EMBEDDING_BATCH_SIZE]),
+            dtype=np.float32
+        )
+        batch_sum = vectors.sum(axis=0)
+        vector_sum = batch_sum if vector_sum is None else vector_sum + batch_sum
+    if vector_sum is None:
+        vector_sum = np.asarray(embeddings.embed_query(program.title), dtype=np.float32)
+    vector = vector_sum / np.linalg.norm(vector_sum)
+    np.save(program.router_path, vector)
+    return vector
+
+
+def discover_programs(data_dir: str = ".") -> List[ProgramInfo]:
+    """Find program datasets produced by `process_curriculum_directory`
+    Args:
+        data_dir (str): directory with curriculum_courses_<program>.csv files
+    Returns:
+        List[ProgramInfo]: found programs sorted by name
+    """
+    programs = []
+    pattern = os.path.join(data_dir, f"{COURSES_FILE_PREFIX}*.csv")
+    for courses_path in sorted(glob.glob(pattern)):
+        name = os.path.basename(courses_path)[len(COURSES_FILE_PREFIX):-len(".csv")]
+        title = _read_program_title(data_dir, name)
+        programs.append(ProgramInfo(
+            name=name,
+            title=title,
+            courses_path=courses_path,
+            router_path=os.path.join(data_dir, f"{ROUTER_FILE_PREFIX}{name}.npy")
+        ))
+    return programs
+
+
+class ProgramRegistry:
+    def __init__(
+            self,
+            data_dir: str = ".",
+            device: str = "cpu",
+            k: int = 5,
+            memory_limit_mb: float = 1024,
+            embeddings: Optional[Embeddings] = None
+    ):
+        """
+        Registry of program retrievers with lazy loading and LRU eviction
+
+        Args:
+            data_dir: Directory with program datasets
+            device: Device for embedding model
+            k: The number of documents to find in each program
+            memory_limit_mb: Memory cap for loaded retrievers, least recently used are evicted
+            embeddings: Embedding model shared by router and all retrievers
+        """
+        self.k = k
+        self.memory_limit_bytes = int(memory_limit_mb * 1024 * 1024)
+        self.embeddings = embeddings if embeddings is not None else init_embeddings(device)
+
+        self.programs: Dict[str, ProgramInfo] = {p.name: p for p in discover_programs(data_dir)}
+        if not self.programs:
+            raise ValueError(f"В директории {data_dir} не найдены файлы {COURSES_FILE_PREFIX}*.csv")
+        logging.info(f"Найдено программ: {len(self.programs)}")
+
+        # Один вектор на программу, этого хватает для выбора программ под запрос
+        self._program_names = list(self.programs)
+        self._program_vectors = np.stack([
+            load_program_vector(self.programs[name], self.embeddings) for name in self._program_names
+        ])
+
+        self._shards: "OrderedDict[str, CourseRetriever]" = OrderedDict()
+        self._shard_bytes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Программы, индекс которых сейчас строится
+        self._loading: Dict[str, threading.Event] = {}
+
+    @property
+    def loaded_bytes(self) -> int:
+        return sum(self._shard_bytes.values())
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return np.asarray(self.embeddings.embed_documents(queries), dtype=np.float32)
+
+    def route(self, query_vectors: np.ndarray, max_programs: int = 2) -> List[List[str]]:
+        """Pick the most relevant programs for every query
+        Args:
+            query_vectors (np.ndarray): normalized query embeddings, shape (n_queries, dim)
+            max_programs (int): the number of programs per query
+        Returns:
+            List[List[str]]: program names for every query, most relevant first
+        """
+        if len(self._program_names) <= max_programs:
+            return [list(self._program_names) for _ in range(len(query_vectors))]
+        scores = query_vectors @ self._program_vectors.T
+        top = np.argsort(-scores, axis=1)[:, :max_programs]
+        return [[self._program_names[i] for i in row] for row in top]
+
+    def get_retriever(self, name: str) -> CourseRetriever:
+        """Get program retriever, loading it on first use
+        Args:
+            name (str): program name
+        Returns:
+            CourseRetriever: retriever over program courses
+        """
+        while True:
+            with self._lock:
+                if name in self._shards:
+                    self._shards.move_to_end(name)
+                    return self._shards[name]
+                loading = self._loading.get(name)
+                if loading is None:
+                    loading = self._loading[name] = threading.Event()
+                    break
+            # Этот индекс уже строит другой поток, ждем и проверяем кэш снова
+            loading.wait()
+
+        # Индекс строим без блокировки, чтобы не мешать запросам к уже загруженным программам
+        try:
+            program = self.programs[name]
+            logging.info(f"Загружаем индекс программы {name}")
+            retriever = init_ensemble_retriever(
+                file_path=program.courses_path,
+                k=self.k,
+                embeddings=self.embeddings
+            )
+            with self._lock:
+                self._shards[name] = retriever
+                self._shard_bytes[name] = retriever.nbytes
+                self._evict()
+            return retriever
+        finally:
+            with self._lock:
+                self._loading.pop(name).set()
+
+    def _evict(self):
+        # Последний загруженный индекс оставляем, даже если он один больше лимита
+        while len(self._shards) > 1 and self.loaded_bytes > self.memory_limit_bytes:
+            name, _ = self._shards.popitem(last=False)
+            self._shard_bytes.pop(name)
+            logging.info(f"Выгружаем индекс программы {name}")
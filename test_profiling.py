@@ -0,0 +1,25 @@
+import os
+import re
+
+from profiling import ProfilingSession
+
+
+class Worker:
+    def build_temporary(self):
+        strings = [f"temporary string {i}" * 4 for i in range(20000)]
+        return len(strings)
+
+
+def test_freed_locals_are_not_reported(tmp_path):
+    session = ProfilingSession([(Worker, "build_temporary")], output_dir=str(tmp_path))
+    session.start()
+    for _ in range(5):
+        Worker().build_temporary()
+    session.stop()
+
+    with open(os.path.join(session.output_dir, "allocations.txt"), encoding="utf-8") as f:
+        report = f.read()
+    # Список (~2.5 MiB) освобождается до выхода из метода, в отчете могут остаться только мелочи
+    line = Worker.build_temporary.__code__.co_firstlineno + 1
+    reported = re.findall(rf"test_profiling\.py:{line}: \+([\d.]+) KiB", report)
+    assert sum(float(size) for size in reported) < 64
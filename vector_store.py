@@ -1,85 +1,299 @@
-from typing import List
+import csv
+from array import array
+from collections import defaultdict
+from typing import Dict, List, Optional
 
+import faiss
 import numpy as np
-from langchain_community.document_loaders.csv_loader import CSVLoader
-from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers import EnsembleRetriever
-from langchain_core.vectorstores.base import VectorStoreRetriever
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_huggingface import HuggingFaceEmbeddings
 
 EMBEDDING_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
 
+# Колонки csv, которые сохраняет parse_pdf
+COURSE_COLUMNS = ["Directory", "Program", "Semester", "Course Name", "Credits", "Hours"]
 
-def init_ensemble_retriever(file_path: str, device: str = "cpu", k: int=5, weights: List[float]=[0.5, 0.5]):
+# Сколько строк эмбеддить за раз при построении индекса
+EMBEDDING_BATCH_SIZE = 1024
+
+
+class CourseStore:
+    """Columnar storage of course rows, rows are addressed by integer id"""
+
+    __slots__ = ("categories", "directory", "program", "semester", "credits", "hours", "_names", "_name_offsets")
+
+    def __init__(self):
+        self.categories: List[str] = []
+        self.directory = array("H")
+        self.program = array("H")
+        self.semester = array("i")
+        self.credits = array("i")
+        self.hours = array("i")
+        # Названия курсов лежат одним utf-8 буфером, строка i - это _names[_name_offsets[i]:_name_offsets[i + 1]]
+        self._names = bytearray()
+        self._name_offsets = array("q", [0])
+
+    @classmethod
+    def from_csv(cls, file_path: str) -> "CourseStore":
+        """Load courses from csv file
+        Args:
+            file_path (str): path to csv file with COURSE_COLUMNS
+        Returns:
+            CourseStore: loaded rows
+        """
+        store = cls()
+        category_ids: Dict[str, int] = {}
+
+        def category(value: str) -> int:
+            if value not in category_ids:
+                category_ids[value] = len(store.categories)
+                store.categories.append(value)
+            return category_ids[value]
+
+        with open(file_path, encoding="utf-8", newline="") as f:
+            for row in csv.DictReader(f):
+                store.directory.append(category(row["Directory"].strip()))
+                store.program.append(category(row["Program"].strip()))
+                store.semester.append(int(row["Semester"]))
+                store.credits.append(int(row["Credits"]))
+                store.hours.append(int(row["Hours"]))
+                store._names += row["Course Name"].strip().encode("utf-8")
+                store._name_offsets.append(len(store._names))
+        return store
+
+    def __len__(self) -> int:
+        return len(self.semester)
+
+    @property
+    def nbytes(self) -> int:
+        columns = (self.directory, self.program, self.semester, self.credits, self.hours, self._name_offsets)
+        return (
+            sum(column.itemsize * len(column) for column in columns)
+            + len(self._names)
+            + sum(len(value.encode("utf-8")) for value in self.categories)
+        )
+
+    def name(self, row_id: int) -> str:
+        return self._names[self._name_offsets[row_id]:self._name_offsets[row_id + 1]].decode("utf-8")
+
+    def page_content(self, row_id: int) -> str:
+        # Тот же текст, что раньше давал CSVLoader с source_column="Course Name"
+        return f"Course Name: {self.name(row_id)}"
+
+    def to_document(self, row_id: int) -> Document:
+        name = self.name(row_id)
+        return Document(
+            page_content=self.page_content(row_id),
+            metadata={
+                "source": name,
+                "row": row_id,
+                "Directory": self.categories[self.directory[row_id]],
+                "Program": self.categories[self.program[row_id]],
+                "Semester": str(self.semester[row_id]),
+                "Credits": str(self.credits[row_id]),
+                "Hours": str(self.hours[row_id]),
+            }
+        )
+
+
+class BM25Index:
+    """Okapi BM25 (same formula as rank_bm25.BM25Okapi) over CSR postings arrays"""
+
+    __slots__ = ("vocab", "idf", "doc_len", "avgdl", "postings_docs", "postings_tf", "postings_offsets", "k1", "b")
+
+    def __init__(self, texts: List[str], k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.vocab: Dict[str, int] = {}
+        postings = defaultdict(dict)
+        doc_len = np.zeros(len(texts), dtype=np.float32)
+        for doc_id, text in enumerate(texts):
+            tokens = text.split()
+            doc_len[doc_id] = len(tokens)
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                postings[term_id][doc_id] = postings[term_id].get(doc_id, 0) + 1
+        self.doc_len = doc_len
+        self.avgdl = float(doc_len.mean()) if len(texts) else 0.0
+
+        df = np.array([len(postings[term_id]) for term_id in range(len(self.vocab))], dtype=np.int64)
+        self.postings_offsets = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        self.postings_offsets[1:] = np.cumsum(df)
+        self.postings_docs = np.empty(int(self.postings_offsets[-1]), dtype=np.int32)
+        self.postings_tf = np.empty(int(self.postings_offsets[-1]), dtype=np.float32)
+        for term_id in range(len(self.vocab)):
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            self.postings_docs[start:end] = list(postings[term_id].keys())
+            self.postings_tf[start:end] = list(postings[term_id].values())
+
+        n_docs = len(texts)
+        self.idf = (np.log(n_docs - df + 0.5) - np.log(df + 0.5)).astype(np.float32)
+        if len(self.idf):
+            self.idf[self.idf < 0] = epsilon * self.idf.mean()
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.idf, self.doc_len, self.postings_docs, self.postings_tf, self.postings_offsets)
+        return sum(a.nbytes for a in arrays) + sum(len(token.encode("utf-8")) for token in self.vocab)
+
+    def search(self, query: str, k: int) -> List[int]:
+        """Find top-k rows for query
+        Args:
+            query (str): user query
+            k (int): the number of rows to find
+        Returns:
+            List[int]: row ids, best first
+        """
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for token in query.split():
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            start, end = self.postings_offsets[term_id], self.postings_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / self.avgdl)
+            scores[docs] += self.idf[term_id] * tf * (self.k1 + 1) / (tf + norm)
+        if k < len(scores):
+            top = np.argpartition(-scores, k)[:k]
+        else:
+            top = np.arange(len(scores))
+        return top[np.argsort(-scores[top], kind="stable")].tolist()
+
+
+class CourseRetriever:
+    """Faiss + bm25 retriever over CourseStore, documents are built only for the fused result rows"""
+
+    __slots__ = ("store", "faiss_index", "bm25_index", "embeddings", "k", "weights", "c", "fused_k")
+
+    def __init__(
+            self,
+            store: CourseStore,
+            faiss_index: faiss.Index,
+            bm25_index: BM25Index,
+            embeddings: Embeddings,
+            k: int = 5,
+            weights: List[float] = [0.5, 0.5],
+            c: int = 60,
+            fused_k: Optional[int] = None
+    ):
+        self.store = store
+        self.faiss_index = faiss_index
+        self.bm25_index = bm25_index
+        self.embeddings = embeddings
+        self.k = k
+        self.weights = weights
+        self.c = c
+        # Как и EnsembleRetriever, по умолчанию отдаем все объединение (до 2k строк)
+        self.fused_k = fused_k
+
+    @property
+    def nbytes(self) -> int:
+        faiss_bytes = self.faiss_index.ntotal * self.faiss_index.d * np.dtype(np.float32).itemsize
+        return self.store.nbytes + self.bm25_index.nbytes + faiss_bytes
+
+    def _fuse(self, faiss_ids: List[int], bm25_ids: List[int]) -> List[int]:
+        # Weighted reciprocal rank fusion, как в EnsembleRetriever
+        scores: Dict[int, float] = {}
+        for ids, weight in zip((faiss_ids, bm25_ids), self.weights):
+            for rank, row_id in enumerate(ids, start=1):
+                scores[row_id] = scores.get(row_id, 0.0) + weight / (rank + self.c)
+        return sorted(scores, key=scores.get, reverse=True)[:self.fused_k]
+
+    def search_ids(self, queries: List[str], query_vectors: Optional[np.ndarray] = None) -> List[List[int]]:
+        """Find row ids for many queries at once (top-k of faiss and bm25, fused)
+        Args:
+            queries (List[str]): user queries
+            query_vectors (Optional[np.ndarray]): precomputed normalized query embeddings (default: embed `queries`)
+        Returns:
+            List[List[int]]: fused row ids for every query
+        """
+        if not queries:
+            return []
+        if query_vectors is None:
+            query_vectors = self.embeddings.embed_documents(queries)
+        query_vectors = np.ascontiguousarray(query_vectors, dtype=np.float32)
+        _, faiss_rows = self.faiss_index.search(query_vectors, self.k)
+        return [
+            self._fuse([i for i in row.tolist() if i != -1], self.bm25_index.search(query, self.k))
+            for query, row in zip(queries, faiss_rows)
+        ]
+
+    def batch_invoke(self, queries: List[str], query_vectors: Optional[np.ndarray] = None) -> List[List[Document]]:
+        return [
+            [self.store.to_document(row_id) for row_id in row_ids]
+            for row_ids in self.search_ids(queries, query_vectors)
+        ]
+
+    def invoke(self, query: str) -> List[Document]:
+        return self.batch_invoke([query])[0]
+
+
+def init_embeddings(device: str = "cpu") -> HuggingFaceEmbeddings:
+    """Initialize embedding model
+    Args:
+        device (str): device for embedding model (default: "cpu")
+    Returns:
+        HuggingFaceEmbeddings: embedding model, can be shared between retrievers
+    """
+    return HuggingFaceEmbeddings(
+        model_name=EMBEDDING_MODEL_NAME,
+        model_kwargs={"device": device},
+        encode_kwargs={"normalize_embeddings": True}
+    )
+
+def init_ensemble_retriever(
+        file_path: str,
+        device: str = "cpu",
+        k: int=5,
+        weights: List[float]=[0.5, 0.5],
+        embeddings: Optional[Embeddings] = None,
+        fused_k: Optional[int] = None
+) -> CourseRetriever:
     """Initialize custom retriever
     Args:
         file_path (str): path to csv file with data for rag
         device (str): device for embedding model (default: "cpu")
         k: (int): the number of documents to find (default: 5)
         weights: (List[float]): score weights of ensemble retriever
+        embeddings (Optional[Embeddings]): already loaded embedding model (default: new model on `device`)
+        fused_k (Optional[int]): cut fused result to this many rows (default: whole fused list, up to 2k)
     """
     assert np.isclose(sum(weights), 1.0, rtol=1e-6, atol=1e-6), \
         f"Sum of weights is: {sum(weights)}, but sum must be equal to 1.0"
     assert len(weights) == 2, f"Len of weights array must be 2, now length is {len(weights)}"
-    faiss_retriever = init_faiss_retriever(file_path, k, device)
-    bm25_retriever = init_bm25_retriever(file_path, k)
-    ensemble_retriever = EnsembleRetriever(
-        retrievers=[faiss_retriever, bm25_retriever], weights=weights
-    )
-    return ensemble_retriever
+    if embeddings is None:
+        embeddings = init_embeddings(device)
+    store = CourseStore.from_csv(file_path)
+    faiss_index = init_faiss_index(store, embeddings)
+    bm25_index = init_bm25_index(store)
+    return CourseRetriever(store, faiss_index, bm25_index, embeddings, k=k, weights=weights, fused_k=fused_k)
 
-def init_faiss_retriever(file_path: str, k: int, device: str = "cpu") -> VectorStoreRetriever:
-    """Initialize faiss retriever
+def init_faiss_index(store: CourseStore, embeddings: Embeddings) -> faiss.Index:
+    """Initialize faiss index, faiss ids are store row ids
     Args:
-        file_path (str): path to csv file
-        device (str): device for embedding model (default: "cpu")
-        k: (int): the number of documents to find (default: 5)
+        store (CourseStore): courses to index
+        embeddings (Embeddings): embedding model with normalized outputs
     Returns:
-        VectorStoreRetriever: faiss retriever
+        faiss.Index: inner product index
     """
-    loader = CSVLoader(
-        file_path=file_path,
-        encoding="utf-8",
-        source_column="Course Name",          # Ищем по названию курса
-        metadata_columns=["Directory", "Program", "Semester", "Credits", "Hours"],  # Дополнительные колонки из CSV
-        csv_args={
-            "fieldnames": ["Directory", "Program", "Semester", "Course Name", "Credits", "Hours"]
-        }
-    )
-    documents = loader.load()
+    index = None
+    for start in range(0, len(store), EMBEDDING_BATCH_SIZE):
+        texts = [store.page_content(i) for i in range(start, min(start + EMBEDDING_BATCH_SIZE, len(store)))]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        if index is None:
+            index = faiss.IndexFlatIP(vectors.shape[1])
+        index.add(vectors)
+    if index is None:
+        index = faiss.IndexFlatIP(len(embeddings.embed_query("")))
+    return index
 
-    embeddings = HuggingFaceEmbeddings(
-        model_name=EMBEDDING_MODEL_NAME,
-        model_kwargs={"device": device},
-        encode_kwargs={"normalize_embeddings": True}
-    )
-
-    vector_db = FAISS.from_documents(
-        documents=documents,
-        embedding=embeddings
-    )
-
-    return vector_db.as_retriever(search_kwargs={'k': k})
-
-def init_bm25_retriever(file_path: str, k: int) -> VectorStoreRetriever:
-    """Initialize bm25 retriever
+def init_bm25_index(store: CourseStore) -> BM25Index:
+    """Initialize bm25 index, bm25 doc ids are store row ids
     Args:
-        file_path (str): path to csv file
-        k: (int): the number of documents to find
+        store (CourseStore): courses to index
     Returns:
-        VectorStoreRetriever: bm25 retriever
+        BM25Index: bm25 index
     """
-    loader = CSVLoader(
-        file_path=file_path,
-        encoding="utf-8",
-        source_column="Course Name",          # Ищем по названию курса
-        metadata_columns=["Directory", "Program", "Semester", "Credits", "Hours"],
-        csv_args={
-            "fieldnames": ["Directory", "Program", "Semester", "Course Name", "Credits", "Hours"]
-        }
-    )
-    documents = loader.load()
-    bm25_retriever = BM25Retriever.from_documents(documents)
-    bm25_retriever.k = k
-    return bm25_retriever
\ No newline at end of file
+    return BM25Index([store.page_content(i) for i in range(len(store))])